@@ -78,8 +78,18 @@ class DataSetwithStats(BasicDataSet):
             mean, std = self.stats_dict[key]
             mean = mean * ma + mean_new * (1-ma)
             std = std * ma + std_new * (1-ma)
+        self.set_stats(key, mean, std)
+
+    def set_stats(self, key, mean, std):
         self.stats_dict[key] = (mean, std)
-        self.stats_dict_tf[key] = (tf.constant(mean, dtype=DTYPE), tf.constant(std, dtype=DTYPE))
+        # variables rather than constants, so that the compiled policy and loss functions read the current stats
+        if self.stats_dict_tf[key] is None:
+            self.stats_dict_tf[key] = (
+                tf.Variable(mean, dtype=DTYPE, trainable=False), tf.Variable(std, dtype=DTYPE, trainable=False)
+            )
+        else:
+            self.stats_dict_tf[key][0].assign(mean)
+            self.stats_dict_tf[key][1].assign(std)
 
     def normalize_data(self, data, key, withtf=False):
         if withtf:
@@ -106,8 +116,7 @@ class DataSetwithStats(BasicDataSet):
             assert key in self.stats_dict, "The key of stats_dict does not match!"
             mean, std = saved_stats[key]
             mean, std = np.asarray(mean).astype(NP_DTYPE), np.asarray(std).astype(NP_DTYPE)
-            self.stats_dict[key] = (mean, std)
-            self.stats_dict_tf[key] = (tf.constant(mean, dtype=DTYPE), tf.constant(std, dtype=DTYPE))
+            self.set_stats(key, mean, std)
 
 
 class InitDataSet(DataSetwithStats):
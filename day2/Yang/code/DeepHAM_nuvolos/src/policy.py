@@ -19,6 +19,18 @@ else:
     raise ValueError("Unknown dtype.")
 log_10 = tf.cast(tf.math.log(10.0), DTYPE)
 eps = tf.cast(1e-8, DTYPE)
+# inputs of the compiled current_c_policy: k_cross, the aggregate state (ashock or N) and ishock,
+# for any number of paths and agents
+C_POLICY_SIGNATURE = [
+    tf.TensorSpec([None, None], DTYPE),
+    tf.TensorSpec([None, 1], DTYPE),
+    tf.TensorSpec([None, None], DTYPE),
+]
+# initial shocks of the compiled simul_shocks_tf, for any number of paths and agents
+SHOCK_INIT_SIGNATURE = {
+    "ashock": tf.TensorSpec([None, 1], DTYPE),
+    "ishock": tf.TensorSpec([None, None], DTYPE),
+}
 
 
 class PolicyTrainer():
@@ -38,38 +50,72 @@ class PolicyTrainer():
             # TODO generalize to multi-dimensional agt_s
             self.gm_model = util.GeneralizedMomModel(1, self.config["n_gm"], self.config["gm_config"], name="p_gm")
         self.train_vars = None
+        # create the variables eagerly, so that the compiled functions below are traced only once
+        self.model(tf.zeros([1, 1, self.model.d_in], DTYPE))
+        if self.config["n_gm"] > 0:
+            self.gm_model(tf.zeros([1, 1, self.gm_model.d_in], DTYPE))
         if policy_path is not None:
             self.model.load_weights_after_init(policy_path)
             if self.config["n_gm"] > 0:
                 self.gm_model.load_weights_after_init(policy_path.replace(".weights.h5", "_gm.weights.h5"))
             self.init_ds.load_stats(os.path.dirname(policy_path))
         self.discount = np.power(self.mparam.beta, np.arange(self.t_unroll))
+        # generator for the shocks simulated on device, seeded from numpy to follow set_random_seed
+        self.rng = tf.random.Generator.from_seed(np.random.randint(2**31 - 1))
         # to be generated in the child class
         self.policy_ds = None
         self.use_log_k = self.config.get("use_log_k", False)
         self.grad_penalty = self.policy_config.get("grad_penalty", False)
-        self.train_loss_metric = tf.keras.metrics.Mean('train_loss', dtype=log_10.dtype)
-        self.valid_loss_metric = tf.keras.metrics.Mean('valid_loss', dtype=log_10.dtype)
+        # the losses are specialized to opt_type once, in the game only agent 0 is optimized
+        assert self.policy_config["opt_type"] in ["socialplanner", "game"], "Unknown opt_type."
+        if self.policy_config["opt_type"] == "game":
+            self.agent_mask = np.eye(1, self.mparam.n_agt)[0].astype(NP_DTYPE)
+        else:
+            self.agent_mask = None
+        # running sum of the training loss, only read and reset when it is written to the summary
+        self.train_loss_sum = tf.Variable(0.0, dtype=DTYPE, trainable=False)
+        self.train_loss_count = 0
+        # the train loss is logged as its mean over freq_log steps (see the README); 1 logs every step
+        self.freq_log = self.policy_config.get("freq_log", 100)
         train_log_dir = os.path.join(self.config["model_path"], 'logs/', self.config["current_time"], 'pnet_train')
         valid_log_dir = os.path.join(self.config["model_path"], 'logs/', self.config["current_time"], 'pnet_valid')
         self.train_summary_writer = tf.summary.create_file_writer(train_log_dir)
         self.valid_summary_writer = tf.summary.create_file_writer(valid_log_dir)
+        # compile the forward paths with XLA; the signatures leave the batch dimension free,
+        # so each function is traced once for training, validation and dataset simulation.
+        # XLA needs the shapes in a gradient at compile time, but with a free batch dimension they reach
+        # the backward pass as runtime values when they cross a function or while_loop boundary. Hence
+        # policy_fn is inlined rather than compiled on its own, and with grad_penalty, whose loss takes
+        # a gradient inside the while_loop, the loss is compiled without XLA.
+        # train_step differentiates the python loss in a plain graph: under XLA the weights it updates
+        # become compile-time constants of the while_loop gradient, and it is recompiled at every step
+        loss = self.loss
+
+        def loss_fn(input_data):
+            # the employment states reach the device as int8, the losses of the child classes get them as DTYPE
+            return loss(dict(input_data, ishock=tf.cast(input_data["ishock"], DTYPE)))
+
+        self.loss_fn = loss_fn
+        self.loss = tf.function(loss_fn, jit_compile=not self.grad_penalty, input_signature=[self.loss_signature()])
+        self.train_step = tf.function(self.train_step, input_signature=[self.loss_signature()])
 
-    @tf.function
     def prepare_state(self, input_data):
+        # no casts below: checked when traced, so it costs nothing in the compiled graph
+        assert input_data["basic_s"].dtype == DTYPE and input_data["agt_s"].dtype == DTYPE, \
+            "prepare_state expects DTYPE states."
         if self.use_log_k:
-            log_k = tf.math.log(tf.cast(input_data["basic_s"][..., 0:1], DTYPE) + eps)/log_10
+            log_k = tf.math.log(input_data["basic_s"][..., 0:1] + eps)/log_10
             log_k_mean = tf.math.reduce_mean(log_k, axis=1 ,keepdims=True)
-            log_k_mean = tf.tile(log_k_mean, [1, input_data["basic_s"].shape[1], 1])
-            basic_s = tf.concat([log_k, log_k_mean, tf.cast(input_data["basic_s"][..., 2:], DTYPE)], axis=-1)
-            agt_s = tf.math.log(tf.cast(input_data["agt_s"], DTYPE))/log_10
+            log_k_mean = tf.tile(log_k_mean, [1, tf.shape(input_data["basic_s"])[1], 1])
+            basic_s = tf.concat([log_k, log_k_mean, input_data["basic_s"][..., 2:]], axis=-1)
+            agt_s = tf.math.log(input_data["agt_s"])/log_10
         else:
-            basic_s = tf.cast(input_data["basic_s"], DTYPE)
-            agt_s = tf.cast(input_data["agt_s"], DTYPE)
+            basic_s = input_data["basic_s"]
+            agt_s = input_data["agt_s"]
         if self.config.get("full_state", False):
             state = tf.concat(
                 [basic_s[..., 0:1], basic_s[..., 2:],
-                 tf.repeat(tf.transpose(tf.cast(input_data["agt_s"], DTYPE), perm=[0, 2, 1]), self.config["n_agt"], axis=-2)],
+                 tf.repeat(tf.transpose(input_data["agt_s"], perm=[0, 2, 1]), self.config["n_agt"], axis=-2)],
                  axis=-1
             )
         elif self.config["n_fm"] == 0:
@@ -77,32 +123,66 @@ class PolicyTrainer():
         elif self.config["n_fm"] == 1:  # so far always add k_mean in the basic_state
             state = basic_s
         elif self.config["n_fm"] == 2:
-            k_var = tf.math.reduce_variance(agt_s, axis=-2, keepdims=True)
-            k_var = tf.tile(k_var, [1, agt_s.shape[1], 1])
+            # one pass over agt_s: Var = E[x^2] - E[x]^2, clipped at 0 against rounding
+            k_mean = tf.reduce_mean(agt_s, axis=-2, keepdims=True)
+            k_var = tf.maximum(tf.reduce_mean(tf.square(agt_s), axis=-2, keepdims=True) - tf.square(k_mean), 0)
+            k_var = util.broadcast_like(k_var, agt_s)
             state = tf.concat([basic_s, k_var], axis=-1)
         if self.config["n_gm"] > 0:
             gm = self.gm_model(agt_s)
             state = tf.concat([state, gm], axis=-1)
         return state
 
-    @tf.function
     def policy_fn(self, input_data):
         state = self.prepare_state(input_data)
         policy = tf.sigmoid(self.sgm_scale*self.model(state))
         return policy
 
-    @tf.function
+    def loss_signature(self):
+        n_agt, T = self.mparam.n_agt, self.t_unroll
+        return {
+            "k_cross": tf.TensorSpec([None, n_agt], DTYPE),
+            "ashock": tf.TensorSpec([None, T], DTYPE),
+            "ishock": tf.TensorSpec([None, n_agt, T], tf.int8),
+        }
+
     def loss(self, input_data):
         raise NotImplementedError
 
+    def terminal_value(self, full_state_dict):
+        # unnormalize is affine, so it can be applied after averaging over the value nets
+        value = util.batched_value_fn(self.vtrainers, full_state_dict)
+        return self.init_ds.unnormalize_data(value, key="value", withtf=True)
+
+    def optimized_share(self, c_share):
+        if self.agent_mask is None:
+            return c_share
+        # the other agents follow the same policy without being optimized, as one fused expression
+        return self.agent_mask*c_share + (1-self.agent_mask)*tf.stop_gradient(c_share)
+
+    def mean_util(self, util_sum):
+        if self.agent_mask is None:
+            return tf.reduce_mean(util_sum)
+        return tf.reduce_mean(util_sum[:, 0])
+
+    def util_array(self):
+        # utilities of the t_unroll-1 policy periods, written per step inside the unrolled loop
+        return tf.TensorArray(DTYPE, size=self.t_unroll-1, element_shape=[None, self.mparam.n_agt])
+
+    def discounted_util(self, util):
+        # a single contraction over time instead of a discounted accumulation in every step
+        # util: (t_unroll-1)*n_path*n_agt
+        discount = tf.constant(self.discount[:-1], DTYPE)
+        return tf.tensordot(discount, util, axes=[[0], [0]])
+
     def grad(self, input_data):
-        with tf.GradientTape(persistent=True) as tape:
-            output_dict = self.loss(input_data)
+        with tf.GradientTape() as tape:
+            output_dict = self.loss_fn(input_data)
             if self.grad_penalty:
                 total_loss = output_dict["m_util"] + 0.1 * output_dict["gp_loss"] # TODO the weight of gp_loss can be modified
             else:
                 total_loss = output_dict["m_util"]
-        self.train_loss_metric(-output_dict["m_util"])
+        self.train_loss_sum.assign_add(-output_dict["m_util"])
         train_vars = self.model.trainable_variables
         if self.config["n_gm"] > 0:
             train_vars += self.gm_model.trainable_variables
@@ -112,10 +192,8 @@ class PolicyTrainer():
             train_vars,
             unconnected_gradients=tf.UnconnectedGradients.ZERO,
         )
-        del tape
         return grad, output_dict["k_end"]
 
-    @tf.function
     def train_step(self, train_data):
         grad, k_end = self.grad(train_data)
         self.optimizer.apply_gradients(
@@ -135,6 +213,11 @@ class PolicyTrainer():
             learning_rate=lr_schedule, epsilon=1e-8,
             beta_1=0.99, beta_2=0.99
         )
+        # as for the nets, the optimizer slots are created before train_step is traced
+        train_vars = self.model.trainable_variables
+        if self.config["n_gm"] > 0:
+            train_vars += self.gm_model.trainable_variables
+        self.optimizer.build(train_vars)
 
         # TODO: currenly assuming valid_size = n_path in self.init_ds
         # --- Build a fixed validation dataset (used repeatedly at the end of each epoch) ---
@@ -148,7 +231,10 @@ class PolicyTrainer():
             state_init=self.init_ds.datadict
         )
         valid_data["ashock"] = ashock.astype(NP_DTYPE)
-        valid_data["ishock"] = ishock.astype(NP_DTYPE)
+        valid_data["ishock"] = ishock.astype(np.int8)  # employment states are cast to DTYPE inside loss
+        # the validation set is fixed, so it is copied to the device once instead of at every validation
+        with tf.device("/GPU:0" if tf.config.list_physical_devices('GPU') else "/CPU:0"):
+            valid_data = dict((k, tf.identity(v)) for k, v in valid_data.items())
 
         # --- Training loop setup ---
         freq_valid  = self.policy_config["freq_valid"]   # = 500 → validate every 500 steps
@@ -186,9 +272,9 @@ class PolicyTrainer():
                         )
                     if tf.config.list_physical_devices('GPU'):
                         print(tf.config.experimental.get_memory_info('GPU:0'))
-                with self.train_summary_writer.as_default():
-                    tf.summary.scalar('loss', self.train_loss_metric.result(), step=n_step)
-                self.train_loss_metric.reset_state()
+                self.train_loss_count += 1
+                if self.train_loss_count == self.freq_log:
+                    self.write_train_loss(n_step)
             
             # --- End of epoch: run validation once (on the fixed valid_data) ---
             val_output = self.loss(valid_data)
@@ -196,10 +282,18 @@ class PolicyTrainer():
                 "Step: %d, valid util: %g, k_end: %g" %
                 (freq_valid*(n+1), -val_output["m_util"], k_end)
             )
-            self.valid_loss_metric(-val_output["m_util"])
             with self.valid_summary_writer.as_default():
-                tf.summary.scalar('loss', self.valid_loss_metric.result(), step=n_step)
-            self.valid_loss_metric.reset_state()
+                tf.summary.scalar('loss', -val_output["m_util"], step=n_step)
+        # flush the last partial window, so it is not carried over into a later call of train
+        if self.train_loss_count > 0:
+            self.write_train_loss(n_step)
+
+    def write_train_loss(self, step):
+        # average training loss since the last write, reading the device only once per window
+        with self.train_summary_writer.as_default():
+            tf.summary.scalar('loss', self.train_loss_sum / self.train_loss_count, step=step)
+        self.train_loss_sum.assign(0.0)
+        self.train_loss_count = 0
 
     def save_model(self, path="policy_model"):
         self.model.save_weights(path)
@@ -210,11 +304,16 @@ class PolicyTrainer():
     def simul_shocks(self, n_sample, T, mparam, state_init):
         raise NotImplementedError
 
+    def simul_shocks_tf(self, state_init):
+        # falls back to simul_shocks in numpy, for child classes without a TensorFlow version
+        ashock, ishock = self.simul_shocks(state_init["ishock"].shape[0], self.t_unroll, self.mparam, state_init)
+        return tf.constant(ashock.astype(NP_DTYPE)), tf.constant(ishock.astype(np.int8))
+
     def sampler(self, batch_size, update_init=False):
         train_data = self.policy_ds.next_batch(batch_size)
-        ashock, ishock = self.simul_shocks(batch_size, self.t_unroll, self.mparam, train_data)
-        train_data["ashock"] = ashock.astype(NP_DTYPE)
-        train_data["ishock"] = ishock.astype(NP_DTYPE)
+        state_init = dict((k, train_data[k]) for k in ["ashock", "ishock"] if k in train_data)
+        # the shocks stay on device until they are consumed by train_step
+        train_data["ashock"], train_data["ishock"] = self.simul_shocks_tf(state_init)
         # TODO test the effect of epoch_resample
         if self.policy_ds.epoch_used > self.policy_config["epoch_resample"]:
             self.update_policydataset(update_init)
@@ -238,66 +337,60 @@ class KSPolicyTrainer(PolicyTrainer):
             policy_type = "nn_share"
         self.policy_ds = self.init_ds.get_policydataset(init_policy, policy_type, update_init=False)
 
-    @tf.function
+    def full_state_dict(self, k_cross, k_mean, a_t, i_t):
+        # k_mean, a_t: n_path*1, i_t: n_path*n_agt
+        basic_s_tmp = tf.stack(
+            [k_cross, util.broadcast_like(k_mean, k_cross), util.broadcast_like(a_t, k_cross), i_t], axis=-1
+        ) # n_path*n_agt*4
+        basic_s_tmp = self.init_ds.normalize_data(basic_s_tmp, key="basic_s", withtf=True)
+        full_state_dict = {
+            "basic_s": basic_s_tmp,
+            "agt_s": self.init_ds.normalize_data(tf.expand_dims(k_cross, axis=-1), key="agt_s", withtf=True)
+        }
+        return full_state_dict
+
     def loss(self, input_data):
         k_cross = input_data["k_cross"]
-        ashock, ishock = input_data["ashock"], input_data["ishock"]
-        util_sum = 0
-
-        for t in range(self.t_unroll):
+        # time-major shocks, so that every period is a contiguous slice: T*n_path*1, T*n_path*n_agt
+        ashock = tf.transpose(input_data["ashock"])[..., None]
+        ishock = tf.transpose(input_data["ishock"], [2, 0, 1])
+        # labor tax rate and total labor supply - depend on ashock, computed for all t at once
+        a_good = tf.cast(ashock >= 1, DTYPE)
+        tau = self.mparam.tau_b + (self.mparam.tau_g - self.mparam.tau_b) * a_good
+        emp = self.mparam.l_bar * (self.mparam.er_b + (self.mparam.er_g - self.mparam.er_b) * a_good)
+
+        def step(t, k_cross, util_ta):
+            a_t, i_t = ashock[t], ishock[t] # n_path*1, n_path*n_agt
+            tau_t, emp_t = tau[t], emp[t]
             k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
-            k_mean_tmp = tf.tile(k_mean, [1, self.mparam.n_agt])
-            k_mean_tmp = tf.expand_dims(k_mean_tmp, axis=-1)
-            i_tmp = ishock[:, :, t:t+1] # n_path*n_agt*1
-            a_tmp = tf.tile(ashock[:, t:t+1], [1, self.mparam.n_agt])
-            a_tmp = tf.expand_dims(a_tmp, axis=2) # n_path*n_agt*1
-            basic_s_tmp = tf.concat([tf.expand_dims(k_cross, axis=-1), k_mean_tmp, a_tmp, i_tmp], axis=-1)
-            basic_s_tmp = self.init_ds.normalize_data(basic_s_tmp, key="basic_s", withtf=True)
-            full_state_dict = {
-                "basic_s": basic_s_tmp,
-                "agt_s": self.init_ds.normalize_data(tf.expand_dims(k_cross, axis=-1), key="agt_s", withtf=True)
-            }
-            if t == self.t_unroll - 1:
-                value = 0
-                for vtr in self.vtrainers:
-                    value += self.init_ds.unnormalize_data(
-                        vtr.value_fn(full_state_dict)[..., 0], key="value", withtf=True)
-                value /= self.num_vnet
-                util_sum += self.discount[t]*value
-                continue
-
-            c_share = self.policy_fn(full_state_dict)[..., 0]
-            if self.policy_config["opt_type"] == "game":
-                # optimizing agent 0 only
-                c_share = tf.concat([c_share[:, 0:1], tf.stop_gradient(c_share[:, 1:])], axis=1)
-            # labor tax rate - depend on ashock
-            tau = tf.where(ashock[:, t:t+1] < 1, self.mparam.tau_b, self.mparam.tau_g)
-            # total labor supply - depend on ashock
-            emp = tf.where(
-                ashock[:, t:t+1] < 1,
-                self.mparam.l_bar*self.mparam.er_b,
-                self.mparam.l_bar*self.mparam.er_g
-            )
-            tau, emp = tf.cast(tau, DTYPE), tf.cast(emp, DTYPE)
-            R = 1 - self.mparam.delta + ashock[:, t:t+1] * self.mparam.alpha*(k_mean / emp)**(self.mparam.alpha-1)
-            wage = ashock[:, t:t+1]*(1-self.mparam.alpha)*(k_mean / emp)**(self.mparam.alpha)
-            wealth = R * k_cross + (1-tau)*wage*self.mparam.l_bar*ishock[:, :, t] + \
-                self.mparam.mu*wage*(1-ishock[:, :, t])
+            c_share = self.policy_fn(self.full_state_dict(k_cross, k_mean, a_t, i_t))[..., 0]
+            c_share = self.optimized_share(c_share)
+            # (K/L)^(alpha-1) is evaluated once in exp/log form and shared by R and wage
+            k_emp = k_mean / emp_t
+            k_pow = tf.exp((self.mparam.alpha-1) * tf.math.log(k_emp))
+            R = 1 - self.mparam.delta + a_t * self.mparam.alpha*k_pow
+            wage = a_t*(1-self.mparam.alpha)*k_pow*k_emp
+            wealth = R * k_cross + (1-tau_t)*wage*self.mparam.l_bar*i_t + \
+                self.mparam.mu*wage*(1-i_t)
             csmp = tf.clip_by_value(c_share * wealth, EPSILON, wealth-EPSILON)
             k_cross = wealth - csmp
-            util_sum += self.discount[t] * tf.math.log(csmp)
-
-        if self.policy_config["opt_type"] == "socialplanner":
-            output_dict = {
-                "m_util": -tf.reduce_mean(util_sum), 
-                "k_end": tf.reduce_mean(k_cross)
-                }
-        elif self.policy_config["opt_type"] == "game":
-            # optimizing agent 0 only
-            output_dict = {
-                "m_util": -tf.reduce_mean(util_sum[:, 0]),
-                "k_end": tf.reduce_mean(k_cross)
-                }
+            util_ta = util_ta.write(t, tf.math.log(csmp))
+            return t + 1, k_cross, util_ta
+
+        # the last period is valued by the value functions instead of the policy
+        _, k_cross, util_ta = tf.while_loop(
+            lambda t, k_cross, util_ta: t < self.t_unroll - 1, step,
+            loop_vars=(tf.constant(0), k_cross, self.util_array()),
+            maximum_iterations=self.t_unroll - 1
+        )
+        k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+        full_state_dict = self.full_state_dict(k_cross, k_mean, ashock[-1], ishock[-1])
+        util_sum = self.discounted_util(util_ta.stack()) + self.discount[-1]*self.terminal_value(full_state_dict)
+
+        output_dict = {
+            "m_util": -self.mean_util(util_sum),
+            "k_end": tf.reduce_mean(k_cross)
+            }
         return output_dict
 
     def update_policydataset(self, update_init=False):
@@ -306,23 +399,21 @@ class KSPolicyTrainer(PolicyTrainer):
     def get_valuedataset(self, update_init=False):
         return self.init_ds.get_valuedataset(self.current_c_policy, "nn_share", update_init)
 
+    @tf.function(jit_compile=True, input_signature=C_POLICY_SIGNATURE)
     def current_c_policy(self, k_cross, ashock, ishock):
-        k_mean = np.mean(k_cross, axis=1, keepdims=True)
-        k_mean = np.repeat(k_mean, self.mparam.n_agt, axis=1)
-        ashock = np.repeat(ashock, self.mparam.n_agt, axis=1)
-        basic_s = np.stack([k_cross, k_mean, ashock, ishock], axis=-1)
-        basic_s = self.init_ds.normalize_data(basic_s, key="basic_s")
-        basic_s = basic_s.astype(NP_DTYPE)
-        full_state_dict = {
-            "basic_s": basic_s,
-            "agt_s": self.init_ds.normalize_data(k_cross[:, :, None], key="agt_s")
-        }
+        # also evaluated step by step inside the device rollout of simul_k
+        k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+        full_state_dict = self.full_state_dict(k_cross, k_mean, ashock, ishock)
         c_share = self.policy_fn(full_state_dict)[..., 0]
         return c_share
 
     def simul_shocks(self, n_sample, T, mparam, state_init):
         return KS.simul_shocks(n_sample, T, mparam, state_init)
 
+    @tf.function(jit_compile=True, input_signature=[SHOCK_INIT_SIGNATURE])
+    def simul_shocks_tf(self, state_init):
+        return KS.simul_shocks_tf(self.t_unroll, self.mparam, state_init, self.rng)
+
 
 class DavilaPolicyTrainer(PolicyTrainer):
     def __init__(self, vtrainers, init_ds, policy_path=None):
@@ -335,69 +426,65 @@ class DavilaPolicyTrainer(PolicyTrainer):
             policy_type = "nn_share"
         self.policy_ds = self.init_ds.get_policydataset(init_policy, policy_type, update_init=False, random_sampling=True)
 
-    @tf.function
+    def full_state_dict(self, k_cross, k_mean, i_t):
+        # k_mean: n_path*1, i_t: n_path*n_agt
+        basic_s_tmp = tf.stack([k_cross, util.broadcast_like(k_mean, k_cross), i_t], axis=-1) # n_path*n_agt*3
+        #basic_s_tmp = self.init_ds.normalize_data(basic_s_tmp, key="basic_s", withtf=True)
+        full_state_dict = {
+            "basic_s": basic_s_tmp,
+            "agt_s": tf.expand_dims(k_cross, axis=-1)
+            #"agt_s": self.init_ds.normalize_data(tf.expand_dims(k_cross, axis=-1), key="agt_s", withtf=True)
+        }
+        return full_state_dict
+
     def loss(self, input_data):
         k_cross = input_data["k_cross"]
         #k_cross = tf.constant(input_data["k_cross"])
-        ishock = input_data["ishock"]
-        util_sum = 0
-        gp_loss = 0
-
-        for t in range(self.t_unroll):
-            with tf.GradientTape() as tape:
+        # time-major shocks, so that every period is a contiguous slice: T*n_path*n_agt
+        ishock = tf.transpose(input_data["ishock"], [2, 0, 1])
+        # total labor supply, emp_g = emp_b
+        emp = tf.cast(self.mparam.emp_g, DTYPE)
+
+        def step(t, k_cross, util_ta, gp_loss):
+            i_t = ishock[t] # n_path*n_agt
+            labor = self.mparam.epsilon_0*(1-i_t)*(2-i_t)/2 + \
+                self.mparam.epsilon_1*i_t*(2-i_t) + \
+                self.mparam.epsilon_2*i_t*(i_t-1)/2
+            # only the policy evaluation is recorded, and only with respect to k_cross
+            with tf.GradientTape(watch_accessed_variables=False) as tape:
                 tape.watch(k_cross)
                 k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
-                k_mean_tmp = tf.tile(k_mean, [1, self.mparam.n_agt])
-                k_mean_tmp = tf.expand_dims(k_mean_tmp, axis=-1)
-                i_tmp = ishock[:, :, t:t+1] # n_path*n_agt*1
-                # a_tmp = tf.tile(ashock[:, t:t+1], [1, self.mparam.n_agt])
-                # a_tmp = tf.expand_dims(a_tmp, axis=2) # n_path*n_agt*1
-                basic_s_tmp = tf.concat([tf.expand_dims(k_cross, axis=-1), k_mean_tmp, i_tmp], axis=-1)
-                #basic_s_tmp = self.init_ds.normalize_data(basic_s_tmp, key="basic_s", withtf=True)
-                full_state_dict = {
-                    "basic_s": basic_s_tmp,
-                    "agt_s": tf.expand_dims(k_cross, axis=-1)
-                    #"agt_s": self.init_ds.normalize_data(tf.expand_dims(k_cross, axis=-1), key="agt_s", withtf=True)
-                }
-                if t == self.t_unroll - 1:
-                    value = 0
-                    for vtr in self.vtrainers:
-                        value += self.init_ds.unnormalize_data(
-                            vtr.value_fn(full_state_dict)[..., 0], key="value", withtf=True)
-                    value /= self.num_vnet
-                    util_sum += self.discount[t]*value
-                    continue
-                c_share = self.policy_fn(full_state_dict)[..., 0]
-                if self.policy_config["opt_type"] == "game":
-                    # optimizing agent 0 only
-                    c_share = tf.concat([c_share[:, 0:1], tf.stop_gradient(c_share[:, 1:])], axis=1)
-                # total labor supply, emp_g = emp_b
-                emp = tf.cast(self.mparam.emp_g, DTYPE)
-                R = 1 - self.mparam.delta + self.mparam.alpha*(k_mean / emp)**(self.mparam.alpha-1)
-                wage = (1-self.mparam.alpha)*(k_mean / emp)**(self.mparam.alpha)
-                wealth_gp = tf.stop_gradient(R) * k_cross + tf.stop_gradient(wage) * (
-                    self.mparam.epsilon_0*(1-ishock[:, :, t])*(2-ishock[:, :, t])/2 + \
-                    self.mparam.epsilon_1*ishock[:, :, t]*(2-ishock[:, :, t]) + \
-                    self.mparam.epsilon_2*ishock[:, :, t]*(ishock[:, :, t]-1)/2
-                )
-                csmp_gp = c_share * wealth_gp
-            gradients = tape.gradient(csmp_gp, k_cross) * log_10 * k_cross
-            gp_loss += tf.keras.activations.relu(-gradients)
-            wealth = R * k_cross + wage * (
-                self.mparam.epsilon_0*(1-ishock[:, :, t])*(2-ishock[:, :, t])/2 + \
-                self.mparam.epsilon_1*ishock[:, :, t]*(2-ishock[:, :, t]) + \
-                self.mparam.epsilon_2*ishock[:, :, t]*(ishock[:, :, t]-1)/2
-            )
+                c_share = self.policy_fn(self.full_state_dict(k_cross, k_mean, i_t))[..., 0]
+                c_share = self.optimized_share(c_share)
+            k_emp = k_mean / emp
+            k_pow = tf.exp((self.mparam.alpha-1) * tf.math.log(k_emp))
+            R = 1 - self.mparam.delta + self.mparam.alpha*k_pow
+            wage = (1-self.mparam.alpha)*k_pow*k_emp
+            wealth = R * k_cross + wage * labor
+            if self.grad_penalty:
+                # d(c_share * wealth)/dk_cross with R and wage held fixed: the policy vjp weighted by wealth
+                # plus the direct term c_share * R
+                R_gp = tf.stop_gradient(R)
+                wealth_gp = R_gp * k_cross + tf.stop_gradient(wage) * labor
+                gradients = tape.gradient(c_share, k_cross, output_gradients=wealth_gp) + c_share * R_gp
+                gp_loss += tf.keras.activations.relu(-gradients * log_10 * k_cross)
             csmp = c_share * wealth
             k_cross = wealth - csmp
-            util_sum += self.discount[t] * (1 - 1/csmp)
-
-        if self.policy_config["opt_type"] == "socialplanner":
-            output_dict = {"m_util": -tf.reduce_mean(util_sum), "gp_loss": tf.reduce_mean(gp_loss), "k_end": tf.reduce_mean(k_cross)}
-        elif self.policy_config["opt_type"] == "game":
-            # optimizing agent 0 only
-            # TODO game gp_loss ???
-            output_dict = {"m_util": -tf.reduce_mean(util_sum[:, 0]), "gp_loss": tf.reduce_mean(gp_loss), "k_end": tf.reduce_mean(k_cross)}
+            util_ta = util_ta.write(t, 1 - 1/csmp)
+            return t + 1, k_cross, util_ta, gp_loss
+
+        # the last period is valued by the value functions instead of the policy
+        _, k_cross, util_ta, gp_loss = tf.while_loop(
+            lambda t, k_cross, util_ta, gp_loss: t < self.t_unroll - 1, step,
+            loop_vars=(tf.constant(0), k_cross, self.util_array(), tf.zeros_like(k_cross)),
+            maximum_iterations=self.t_unroll - 1
+        )
+        k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+        full_state_dict = self.full_state_dict(k_cross, k_mean, ishock[-1])
+        util_sum = self.discounted_util(util_ta.stack()) + self.discount[-1]*self.terminal_value(full_state_dict)
+
+        # TODO game gp_loss ???
+        output_dict = {"m_util": -self.mean_util(util_sum), "gp_loss": tf.reduce_mean(gp_loss), "k_end": tf.reduce_mean(k_cross)}
         return output_dict
 
     def update_policydataset(self, update_init=True):
@@ -406,24 +493,21 @@ class DavilaPolicyTrainer(PolicyTrainer):
     def get_valuedataset(self, update_init=True):
         return self.init_ds.get_valuedataset(self.current_c_policy, "nn_share", update_init)
 
+    @tf.function(jit_compile=True, input_signature=C_POLICY_SIGNATURE[0::2])  # k_cross and ishock
     def current_c_policy(self, k_cross, ishock):
-        k_mean = np.mean(k_cross, axis=1, keepdims=True)
-        k_mean = np.repeat(k_mean, self.mparam.n_agt, axis=1)
-        # ashock = np.repeat(ashock, self.mparam.n_agt, axis=1)
-        basic_s = np.stack([k_cross, k_mean, ishock], axis=-1)
-        #basic_s = self.init_ds.normalize_data(basic_s, key="basic_s")
-        basic_s = basic_s.astype(NP_DTYPE)
-        full_state_dict = {
-            "basic_s": basic_s,
-            "agt_s": k_cross[:, :, None]
-            #"agt_s": self.init_ds.normalize_data(k_cross[:, :, None], key="agt_s")
-        }
+        # also evaluated step by step inside the device rollout of simul_k
+        k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+        full_state_dict = self.full_state_dict(k_cross, k_mean, ishock)
         c_share = self.policy_fn(full_state_dict)[..., 0]
         return c_share
 
     def simul_shocks(self, n_sample, T, mparam, state_init):
         return Davila.simul_shocks(n_sample, T, mparam, state_init)
 
+    @tf.function(jit_compile=True, input_signature=[SHOCK_INIT_SIGNATURE])
+    def simul_shocks_tf(self, state_init):
+        return Davila.simul_shocks_tf(self.t_unroll, self.mparam, state_init, self.rng)
+
 
 class DavilaASPolicyTrainer(PolicyTrainer):
     def __init__(self, vtrainers, init_ds, policy_path=None):
@@ -436,57 +520,57 @@ class DavilaASPolicyTrainer(PolicyTrainer):
             policy_type = "nn_share"
         self.policy_ds = self.init_ds.get_policydataset(init_policy, policy_type, update_init=False)
 
-    @tf.function
+    def full_state_dict(self, k_cross, k_mean, a_t, i_t):
+        # k_mean, a_t: n_path*1, i_t: n_path*n_agt
+        basic_s_tmp = tf.stack(
+            [k_cross, util.broadcast_like(k_mean, k_cross), util.broadcast_like(a_t, k_cross), i_t], axis=-1
+        ) # n_path*n_agt*4
+        basic_s_tmp = self.init_ds.normalize_data(basic_s_tmp, key="basic_s", withtf=True)
+        full_state_dict = {
+            "basic_s": basic_s_tmp,
+            "agt_s": self.init_ds.normalize_data(tf.expand_dims(k_cross, axis=-1), key="agt_s", withtf=True)
+        }
+        return full_state_dict
+
     def loss(self, input_data):
         k_cross = input_data["k_cross"]
-        ashock, ishock = input_data["ashock"], input_data["ishock"]
-        util_sum = 0
-
-        for t in range(self.t_unroll):
+        # time-major shocks, so that every period is a contiguous slice: T*n_path*1, T*n_path*n_agt
+        ashock = tf.transpose(input_data["ashock"])[..., None]
+        ishock = tf.transpose(input_data["ishock"], [2, 0, 1])
+        # total labor supply - depend on ashock, computed for all t at once
+        emp = self.mparam.emp_b + (self.mparam.emp_g - self.mparam.emp_b) * tf.cast(ashock >= 1, DTYPE)
+
+        def step(t, k_cross, util_ta):
+            a_t, i_t = ashock[t], ishock[t] # n_path*1, n_path*n_agt
+            emp_t = emp[t]
             k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
-            k_mean_tmp = tf.tile(k_mean, [1, self.mparam.n_agt])
-            k_mean_tmp = tf.expand_dims(k_mean_tmp, axis=-1)
-            i_tmp = ishock[:, :, t:t+1] # n_path*n_agt*1
-            a_tmp = tf.tile(ashock[:, t:t+1], [1, self.mparam.n_agt])
-            a_tmp = tf.expand_dims(a_tmp, axis=2) # n_path*n_agt*1
-            basic_s_tmp = tf.concat([tf.expand_dims(k_cross, axis=-1), k_mean_tmp, a_tmp, i_tmp], axis=-1)
-            basic_s_tmp = self.init_ds.normalize_data(basic_s_tmp, key="basic_s", withtf=True)
-            full_state_dict = {
-                "basic_s": basic_s_tmp,
-                "agt_s": self.init_ds.normalize_data(tf.expand_dims(k_cross, axis=-1), key="agt_s", withtf=True)
-            }
-            if t == self.t_unroll - 1:
-                value = 0
-                for vtr in self.vtrainers:
-                    value += self.init_ds.unnormalize_data(
-                        vtr.value_fn(full_state_dict)[..., 0], key="value", withtf=True)
-                value /= self.num_vnet
-                util_sum += self.discount[t]*value
-                continue
-
-            c_share = self.policy_fn(full_state_dict)[..., 0]
-            if self.policy_config["opt_type"] == "game":
-                # optimizing agent 0 only
-                c_share = tf.concat([c_share[:, 0:1], tf.stop_gradient(c_share[:, 1:])], axis=1)
-            # total labor supply
-            emp = tf.where(ashock[:, t:t+1] < 1, self.mparam.emp_b, self.mparam.emp_g)
-            emp = tf.cast(emp, DTYPE)
-            R = 1 - self.mparam.delta + ashock[:, t:t+1]*self.mparam.alpha*(k_mean / emp)**(self.mparam.alpha-1)
-            wage = ashock[:, t:t+1]*(1-self.mparam.alpha)*(k_mean / emp)**(self.mparam.alpha)
+            c_share = self.policy_fn(self.full_state_dict(k_cross, k_mean, a_t, i_t))[..., 0]
+            c_share = self.optimized_share(c_share)
+            k_emp = k_mean / emp_t
+            k_pow = tf.exp((self.mparam.alpha-1) * tf.math.log(k_emp))
+            R = 1 - self.mparam.delta + a_t*self.mparam.alpha*k_pow
+            wage = a_t*(1-self.mparam.alpha)*k_pow*k_emp
             wealth = R * k_cross + wage * (
-                self.mparam.epsilon_0*(1-ishock[:, :, t])*(2-ishock[:, :, t])/2 + \
-                self.mparam.epsilon_1*ishock[:, :, t]*(2-ishock[:, :, t]) + \
-                self.mparam.epsilon_2*ishock[:, :, t]*(ishock[:, :, t]-1)/2
+                self.mparam.epsilon_0*(1-i_t)*(2-i_t)/2 + \
+                self.mparam.epsilon_1*i_t*(2-i_t) + \
+                self.mparam.epsilon_2*i_t*(i_t-1)/2
             )
             csmp = tf.clip_by_value(c_share * wealth, EPSILON, wealth-EPSILON)
             k_cross = wealth - csmp
-            util_sum += self.discount[t] * (1 - 1/csmp)
+            util_ta = util_ta.write(t, 1 - 1/csmp)
+            return t + 1, k_cross, util_ta
+
+        # the last period is valued by the value functions instead of the policy
+        _, k_cross, util_ta = tf.while_loop(
+            lambda t, k_cross, util_ta: t < self.t_unroll - 1, step,
+            loop_vars=(tf.constant(0), k_cross, self.util_array()),
+            maximum_iterations=self.t_unroll - 1
+        )
+        k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+        full_state_dict = self.full_state_dict(k_cross, k_mean, ashock[-1], ishock[-1])
+        util_sum = self.discounted_util(util_ta.stack()) + self.discount[-1]*self.terminal_value(full_state_dict)
 
-        if self.policy_config["opt_type"] == "socialplanner":
-            output_dict = {"m_util": -tf.reduce_mean(util_sum), "k_end": tf.reduce_mean(k_cross)}
-        elif self.policy_config["opt_type"] == "game":
-            # optimizing agent 0 only
-            output_dict = {"m_util": -tf.reduce_mean(util_sum[:, 0]), "k_end": tf.reduce_mean(k_cross)}
+        output_dict = {"m_util": -self.mean_util(util_sum), "k_end": tf.reduce_mean(k_cross)}
         return output_dict
 
     def update_policydataset(self, update_init=False):
@@ -495,23 +579,21 @@ class DavilaASPolicyTrainer(PolicyTrainer):
     def get_valuedataset(self, update_init=False):
         return self.init_ds.get_valuedataset(self.current_c_policy, "nn_share", update_init)
 
+    @tf.function(jit_compile=True, input_signature=C_POLICY_SIGNATURE)
     def current_c_policy(self, k_cross, ashock, ishock):
-        k_mean = np.mean(k_cross, axis=1, keepdims=True)
-        k_mean = np.repeat(k_mean, self.mparam.n_agt, axis=1)
-        ashock = np.repeat(ashock, self.mparam.n_agt, axis=1)
-        basic_s = np.stack([k_cross, k_mean, ashock, ishock], axis=-1)
-        basic_s = self.init_ds.normalize_data(basic_s, key="basic_s")
-        basic_s = basic_s.astype(NP_DTYPE)
-        full_state_dict = {
-            "basic_s": basic_s,
-            "agt_s": self.init_ds.normalize_data(k_cross[:, :, None], key="agt_s")
-        }
+        # also evaluated step by step inside the device rollout of simul_k
+        k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+        full_state_dict = self.full_state_dict(k_cross, k_mean, ashock, ishock)
         c_share = self.policy_fn(full_state_dict)[..., 0]
         return c_share
 
     def simul_shocks(self, n_sample, T, mparam, state_init):
         return DavilaAS.simul_shocks(n_sample, T, mparam, state_init)
 
+    @tf.function(jit_compile=True, input_signature=[SHOCK_INIT_SIGNATURE])
+    def simul_shocks_tf(self, state_init):
+        return DavilaAS.simul_shocks_tf(self.t_unroll, self.mparam, state_init, self.rng)
+
 
 class JFVPolicyTrainer(PolicyTrainer):
     def __init__(self, vtrainers, init_ds, policy_path=None):
@@ -525,57 +607,59 @@ class JFVPolicyTrainer(PolicyTrainer):
         self.policy_ds = self.init_ds.get_policydataset(init_policy, policy_type, update_init=False)
         self.with_ashock = self.mparam.with_ashock
 
-    @tf.function
+    def loss_signature(self):
+        signature = super().loss_signature()
+        signature["N"] = tf.TensorSpec([None, 1], DTYPE)
+        return signature
+
+    def full_state_dict(self, k_cross, k_mean, N, i_t):
+        # k_mean, N: n_path*1, i_t: n_path*n_agt
+        basic_s_tmp = tf.stack(
+            [k_cross, util.broadcast_like(k_mean, k_cross), util.broadcast_like(N, k_cross), i_t], axis=-1
+        ) # n_path*n_agt*4
+        basic_s_tmp = self.init_ds.normalize_data(basic_s_tmp, key="basic_s", withtf=True)
+        full_state_dict = {
+            "basic_s": basic_s_tmp,
+            "agt_s": self.init_ds.normalize_data(tf.expand_dims(k_cross, axis=-1), key="agt_s", withtf=True)
+        }
+        return full_state_dict
+
     def loss(self, input_data):
         k_cross, N = input_data["k_cross"], input_data["N"]
-        ashock, ishock = input_data["ashock"], input_data["ishock"]
-        util_sum = 0
+        # time-major shocks, so that every period is a contiguous slice: T*n_path*1, T*n_path*n_agt
+        ashock = tf.transpose(input_data["ashock"])[..., None]
+        ishock = tf.transpose(input_data["ishock"], [2, 0, 1])
 
-        for t in range(self.t_unroll):
+        def step(carry, shocks):
+            k_cross, N, _ = carry
+            a_t, i_t = shocks # n_path*1, n_path*n_agt
             k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
-            k_mean_tmp = tf.tile(k_mean, [1, self.mparam.n_agt])
-            k_mean_tmp = tf.expand_dims(k_mean_tmp, axis=-1)
-            i_tmp = ishock[:, :, t:t+1]
-            N_tmp = tf.tile(N, [1, self.mparam.n_agt])
-            N_tmp = tf.expand_dims(N_tmp, axis=-1) # n_path*n_agt*1
-            basic_s_tmp = tf.concat([tf.expand_dims(k_cross, axis=-1), k_mean_tmp, N_tmp, i_tmp], axis=-1)
-            basic_s_tmp = self.init_ds.normalize_data(basic_s_tmp, key="basic_s", withtf=True)
-            full_state_dict = {
-                "basic_s": basic_s_tmp,
-                "agt_s": self.init_ds.normalize_data(tf.expand_dims(k_cross, axis=-1), key="agt_s", withtf=True)
-            }
-            if t == self.t_unroll - 1:
-                value = 0
-                for vtr in self.vtrainers:
-                    value += self.init_ds.unnormalize_data(
-                        vtr.value_fn(full_state_dict)[..., 0], key="value", withtf=True)
-                value /= self.num_vnet
-                util_sum = util_sum * self.mparam.dt + self.discount[t]*value
-                continue
-
-            c_share = self.policy_fn(full_state_dict)[..., 0]
-            if self.policy_config["opt_type"] == "game":
-                # optimizing agent 0 only
-                c_share = tf.concat([c_share[:, 0:1], tf.stop_gradient(c_share[:, 1:])], axis=1)
+            c_share = self.policy_fn(self.full_state_dict(k_cross, k_mean, N, i_t))[..., 0]
+            c_share = self.optimized_share(c_share)
 
             K = N + k_mean
-            wage_unit = (1 - self.mparam.alpha) * K**self.mparam.alpha
-            r = self.mparam.alpha * K**(self.mparam.alpha-1) - self.mparam.delta - self.mparam.sigma2*K/N
-            wage = (ishock[:, :, t] * (self.mparam.z2-self.mparam.z1) + self.mparam.z1) * wage_unit  # map 0/1 to z1/z2
+            mpk = self.mparam.alpha * tf.exp((self.mparam.alpha-1) * tf.math.log(K))  # shared by r and dN_drift
+            wage_unit = (1 - self.mparam.alpha) / self.mparam.alpha * mpk * K
+            r = mpk - self.mparam.delta - self.mparam.sigma2*K/N
+            wage = (i_t * (self.mparam.z2-self.mparam.z1) + self.mparam.z1) * wage_unit  # map 0/1 to z1/z2
             wealth = (1 + r*self.mparam.dt) * k_cross + wage * self.mparam.dt
             csmp = tf.clip_by_value(c_share * wealth / self.mparam.dt, EPSILON, wealth/self.mparam.dt-EPSILON)
             k_cross = wealth - csmp * self.mparam.dt
-            dN_drift = self.mparam.dt * (self.mparam.alpha * K**(self.mparam.alpha-1) - self.mparam.delta - \
+            dN_drift = self.mparam.dt * (mpk - self.mparam.delta - \
                 self.mparam.rhohat - self.mparam.sigma2*(-k_mean/N)*(K/N))*N
-            dN_diff = K * ashock[:, t:t+1]
+            dN_diff = K * a_t
             N = tf.maximum(N + dN_drift + dN_diff, 0.01)
-            util_sum += self.discount[t] * (1 - 1/csmp)
+            return k_cross, N, 1 - 1/csmp
+
+        # scan over the shocks of the policy periods,
+        # the last period is valued by the value functions instead of the policy
+        k_cross, N, util = tf.scan(step, (ashock[:-1], ishock[:-1]), initializer=(k_cross, N, tf.zeros_like(k_cross)))
+        k_cross, N = k_cross[-1], N[-1]
+        k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+        full_state_dict = self.full_state_dict(k_cross, k_mean, N, ishock[-1])
+        util_sum = self.discounted_util(util) * self.mparam.dt + self.discount[-1]*self.terminal_value(full_state_dict)
 
-        if self.policy_config["opt_type"] == "socialplanner":
-            output_dict = {"m_util": -tf.reduce_mean(util_sum), "k_end": tf.reduce_mean(k_cross)}
-        elif self.policy_config["opt_type"] == "game":
-            # optimizing agent 0 only
-            output_dict = {"m_util": -tf.reduce_mean(util_sum[:, 0]), "k_end": tf.reduce_mean(k_cross)}
+        output_dict = {"m_util": -self.mean_util(util_sum), "k_end": tf.reduce_mean(k_cross)}
         return output_dict
 
     def update_policydataset(self, update_init=False):
@@ -585,19 +669,17 @@ class JFVPolicyTrainer(PolicyTrainer):
     def get_valuedataset(self, update_init=False):
         return self.init_ds.get_valuedataset(self.current_c_policy, "nn_share", update_init)
 
+    @tf.function(jit_compile=True, input_signature=C_POLICY_SIGNATURE)
     def current_c_policy(self, k_cross, N, ishock):
-        k_mean = np.mean(k_cross, axis=1, keepdims=True)
-        k_mean = np.repeat(k_mean, self.mparam.n_agt, axis=1)
-        N_tmp = np.repeat(N, self.mparam.n_agt, axis=1)
-        basic_s = np.stack([k_cross, k_mean, N_tmp, ishock], axis=-1)
-        basic_s = self.init_ds.normalize_data(basic_s, key="basic_s")
-        basic_s = basic_s.astype(NP_DTYPE)
-        full_state_dict = {
-            "basic_s": basic_s,
-            "agt_s": self.init_ds.normalize_data(k_cross[:, :, None], key="agt_s")
-        }
+        # also evaluated step by step inside the device rollout of simul_k
+        k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+        full_state_dict = self.full_state_dict(k_cross, k_mean, N, ishock)
         c_share = self.policy_fn(full_state_dict)[..., 0]
         return c_share
 
     def simul_shocks(self, n_sample, T, mparam, state_init):
         return JFV.simul_shocks(n_sample, T, mparam, state_init)
+
+    @tf.function(jit_compile=True, input_signature=[{"ishock": SHOCK_INIT_SIGNATURE["ishock"]}])
+    def simul_shocks_tf(self, state_init):
+        return JFV.simul_shocks_tf(self.t_unroll, self.mparam, state_init, self.rng)
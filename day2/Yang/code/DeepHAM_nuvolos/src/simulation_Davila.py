@@ -1,4 +1,6 @@
+import functools
 import numpy as np
+import tensorflow as tf
 from scipy.interpolate import interp1d
 import quantecon as qe
 
@@ -23,6 +25,27 @@ def simul_shocks(n_sample, T, mparam, state_init=None):
     return ashock, ishock
 
 
+def markov_step_tf(cdf, rand):
+    # next state of a finite Markov chain, cdf[..., j] is the probability to move to a state <= j
+    # from the current state; same sampling rule as quantecon's MarkovChain.simulate
+    return tf.reduce_sum(tf.cast(rand[..., None] >= cdf, "int32"), axis=-1)
+
+
+def simul_shocks_tf(T, mparam, state_init, rng):
+    # TensorFlow version of simul_shocks starting from state_init, with random numbers drawn from
+    # the tf.random.Generator rng, so that the shocks are simulated on device
+    # return ashock [n_sample, T], ishock [n_sample, n_agt, T]
+    y_init = tf.cast(state_init["ishock"], "int32")
+    shape = tf.shape(y_init)
+    # ashock is not used
+    ashock = tf.ones([shape[0], T], dtype="float64")
+    cdf = tf.constant(np.cumsum(mparam.prob_trans, axis=1)[:, :-1], dtype="float64")
+    rand = rng.uniform(tf.concat([[T-1], shape], axis=0), dtype="float64")
+    ishock = tf.scan(lambda y_agt, rand_t: markov_step_tf(tf.gather(cdf, y_agt), rand_t), rand, initializer=y_init)
+    ishock = tf.transpose(tf.concat([y_init[None], ishock], axis=0), [1, 2, 0])
+    return ashock, tf.cast(ishock, "int8")
+
+
 def simul_k(n_sample, T, mparam, policy, policy_type, state_init=None, shocks=None, func=None):
     # input:
     #   policy_type: "pde" or "nn_share"
@@ -78,7 +101,19 @@ def simul_k(n_sample, T, mparam, policy, policy_type, state_init=None, shocks=No
             else:
                 k_cross[t] = cur_k
                 csmp[t-1] = cur_csmp
-    if policy_type == "nn_share":
+    if policy_type == "nn_share" and isinstance(policy, tf.types.experimental.PolymorphicFunction):
+        # a compiled policy is rolled out on device, the trajectories are copied back to numpy only once
+        k_path, csmp_path = simul_k_tf(mparam, policy)(tf.cast(cur_k, "float64"), tf.cast(ishock, "float64"))
+        k_path, csmp_path = k_path.numpy(), csmp_path.numpy()
+        cur_k, cur_csmp = k_path[-1], csmp_path[-1]
+        if func:
+            if func != 'last':
+                for t in range(1, T):
+                    res[t] = func(k_path[t], csmp_path[t-1])
+        else:
+            # as in the pde branch, the first period of k_cross is left at zero
+            k_cross[1:], csmp = k_path[1:], csmp_path
+    elif policy_type == "nn_share":
         for t in range(1, T):
             wealth = next_wealth(cur_k, ishock[:, :, t-1], mparam)
             cur_csmp = np.clip(policy(cur_k, ishock[:, :, t-1]) * wealth, EPSILON, wealth-EPSILON)
@@ -109,6 +144,42 @@ def next_wealth(k_cross, ishock, mparam):
     return wealth
 
 
+def next_wealth_tf(k_cross, ishock, mparam):
+    # TensorFlow version of next_wealth, ishock in {0, 1, 2}
+    k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+    R = 1 - mparam.delta +  mparam.alpha*(k_mean / mparam.emp_g)**(mparam.alpha-1)
+    wage = (1-mparam.alpha)*(k_mean / mparam.emp_g)**(mparam.alpha)
+    wealth = R * k_cross + wage * (
+        mparam.epsilon_0*(1-ishock)*(2-ishock)/2 + mparam.epsilon_1*ishock*(2-ishock) + mparam.epsilon_2*ishock*(ishock-1)/2
+    )
+    return wealth
+
+
+@functools.lru_cache(maxsize=None)
+def simul_k_tf(mparam, policy):
+    # TensorFlow version of the "nn_share" branch of simul_k, with policy a compiled TensorFlow function.
+    # It is compiled once for each mparam and policy, which it closes over, with a signature that
+    # leaves the number of paths, agents and periods free
+    # return k_cross [T, n_sample, n_agt], csmp [T-1, n_sample, n_agt]
+    @tf.function(jit_compile=True, input_signature=[
+        tf.TensorSpec([None, None], "float64"),
+        tf.TensorSpec([None, None, None], "float64"),
+    ])
+    def rollout(k_init, ishock):
+        ishock = tf.transpose(ishock, [2, 0, 1])  # T*n_sample*n_agt
+
+        def step(carry, i_t):
+            k_cross, _ = carry
+            wealth = next_wealth_tf(k_cross, i_t, mparam)
+            csmp = tf.clip_by_value(policy(k_cross, i_t) * wealth, EPSILON, wealth-EPSILON)
+            return wealth - csmp, csmp
+
+        k_cross, csmp = tf.scan(step, ishock[:-1], initializer=(k_init, tf.zeros_like(k_init)))
+        return tf.concat([k_init[None], k_cross], axis=0), csmp
+
+    return rollout
+
+
 def k_policy_spl(k_cross, ishock, splines):
     k_next = np.zeros_like(k_cross)
     for i in range(3):
@@ -1,7 +1,10 @@
+import functools
 import numpy as np
+import tensorflow as tf
 from scipy.interpolate import interp1d
 import quantecon as qe
 from scipy.interpolate import RectBivariateSpline
+from simulation_Davila import markov_step_tf
 
 EPSILON = 1e-3
 
@@ -63,6 +66,40 @@ def simul_shocks(n_sample, T, mparam, state_init=None):
     return ashock, ishock
 
 
+def simul_shocks_tf(T, mparam, state_init, rng):
+    # TensorFlow version of simul_shocks starting from state_init, with random numbers drawn from
+    # the tf.random.Generator rng, so that the shocks are simulated on device
+    # return ashock [n_sample, T], ishock [n_sample, n_agt, T]
+    # convert productivity to 0/1 variable
+    a_init = tf.round(((tf.cast(state_init["ashock"][:, 0], "float64") - 1) / mparam.delta_a + 1) / 2)
+    y_init = tf.cast(state_init["ishock"], "int32")
+    shape = tf.shape(y_init)
+    if_keep = tf.cast(rng.uniform([T-1, shape[0]], dtype="float64") < 0.875, "float64")  # prob for Z to stay the same is 0.875
+    rand = rng.uniform(tf.concat([[T-1], shape], axis=0), dtype="float64")
+    if mparam.ashock_type == "IAS":
+        cdf_g = cdf_b = tf.constant(np.cumsum(mparam.prob_trans, axis=1)[:, :-1], dtype="float64")
+    elif mparam.ashock_type in ["CIS", "CIS_rare"]:
+        # ishock realization depend on ashock
+        cdf_g = tf.constant(np.cumsum(mparam.trans_g, axis=1)[:, :-1], dtype="float64")
+        cdf_b = tf.constant(np.cumsum(mparam.trans_b, axis=1)[:, :-1], dtype="float64")
+    else:
+        raise ValueError(f"Unsupported ashock_type: {mparam.ashock_type}")
+
+    def step(carry, elems):
+        a_prev, y_agt = carry
+        keep, rand_t = elems
+        a_next = keep * a_prev + (1 - keep) * (1 - a_prev)
+        a1 = a_next[:, None, None]
+        cdf = a1 * tf.gather(cdf_g, y_agt) + (1 - a1) * tf.gather(cdf_b, y_agt)
+        return a_next, markov_step_tf(cdf, rand_t)
+
+    ashock, ishock = tf.scan(step, (if_keep, rand), initializer=(a_init, y_init))
+    ashock = tf.transpose(tf.concat([a_init[None], ashock], axis=0))
+    ishock = tf.transpose(tf.concat([y_init[None], ishock], axis=0), [1, 2, 0])
+    ashock = (ashock * 2 - 1) * mparam.delta_a + 1  # convert 0/1 variable to productivity
+    return ashock, tf.cast(ishock, "int8")
+
+
 def simul_k(n_sample, T, mparam, policy, policy_type, state_init=None, shocks=None):
     # policy_type: "pde" or "nn_share"
     # return k_cross [n_sample, n_agt, T]
@@ -94,7 +131,14 @@ def simul_k(n_sample, T, mparam, policy, policy_type, state_init=None, shocks=No
             # avoid csmp being too small or even negative
             k_cross[:, :, t] = np.clip(k_cross_t, EPSILON, wealth[:, :, t]-np.minimum(1.0, 0.8*wealth[:, :, t]))
             csmp[:, :, t-1] = wealth[:, :, t] - k_cross[:, :, t]
-    if policy_type == "nn_share":
+    if policy_type == "nn_share" and isinstance(policy, tf.types.experimental.PolymorphicFunction):
+        # a compiled policy is rolled out on device, the trajectories are copied back to numpy only once
+        k_path, csmp_path = simul_k_tf(mparam, policy)(
+            tf.cast(k_cross[:, :, 0], "float64"), tf.cast(ashock, "float64"), tf.cast(ishock, "float64")
+        )
+        k_cross = np.transpose(k_path.numpy(), (1, 2, 0))
+        csmp = np.transpose(csmp_path.numpy(), (1, 2, 0))
+    elif policy_type == "nn_share":
         for t in range(1, T):
             wealth[:, :, t] = next_wealth(k_cross[:, :, t-1], ashock[:, t-1:t], ishock[:, :, t-1], mparam)
             csmp_t = policy(k_cross[:, :, t-1], ashock[:, t-1:t], ishock[:, :, t-1]) * wealth[:, :, t]
@@ -116,6 +160,46 @@ def next_wealth(k_cross, ashock, ishock, mparam):
     )
     return wealth
 
+
+def next_wealth_tf(k_cross, ashock, ishock, mparam):
+    # TensorFlow version of next_wealth, ishock in {0, 1, 2}
+    k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+    emp = mparam.emp_b + (mparam.emp_g - mparam.emp_b) * tf.cast(ashock >= 1, k_cross.dtype)
+    R = 1 - mparam.delta +  ashock*mparam.alpha*(k_mean / emp)**(mparam.alpha-1)
+    wage = ashock*(1-mparam.alpha)*(k_mean / emp)**(mparam.alpha)
+    wealth = R * k_cross + wage * (
+        mparam.epsilon_0*(1-ishock)*(2-ishock)/2 + mparam.epsilon_1*ishock*(2-ishock) + mparam.epsilon_2*ishock*(ishock-1)/2
+    )
+    return wealth
+
+
+@functools.lru_cache(maxsize=None)
+def simul_k_tf(mparam, policy):
+    # TensorFlow version of the "nn_share" branch of simul_k, with policy a compiled TensorFlow function.
+    # It is compiled once for each mparam and policy, which it closes over, with a signature that
+    # leaves the number of paths, agents and periods free
+    # return k_cross [T, n_sample, n_agt], csmp [T-1, n_sample, n_agt]
+    @tf.function(jit_compile=True, input_signature=[
+        tf.TensorSpec([None, None], "float64"),
+        tf.TensorSpec([None, None], "float64"),
+        tf.TensorSpec([None, None, None], "float64"),
+    ])
+    def rollout(k_init, ashock, ishock):
+        ashock = tf.transpose(ashock)[..., None]  # T*n_sample*1
+        ishock = tf.transpose(ishock, [2, 0, 1])  # T*n_sample*n_agt
+
+        def step(carry, shocks):
+            k_cross, _ = carry
+            a_t, i_t = shocks
+            wealth = next_wealth_tf(k_cross, a_t, i_t, mparam)
+            csmp = tf.clip_by_value(policy(k_cross, a_t, i_t) * wealth, EPSILON, wealth-EPSILON)
+            return wealth - csmp, csmp
+
+        k_cross, csmp = tf.scan(step, (ashock[:-1], ishock[:-1]), initializer=(k_init, tf.zeros_like(k_init)))
+        return tf.concat([k_init[None], k_cross], axis=0), csmp
+
+    return rollout
+
 def k_policy_spl(k_cross, ashock, ishock, splines, policy_config):
     opt_type = policy_config.get("opt_type", "")
     
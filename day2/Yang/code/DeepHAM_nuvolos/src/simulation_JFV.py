@@ -1,4 +1,6 @@
+import functools
 import numpy as np
+import tensorflow as tf
 from scipy.interpolate import RectBivariateSpline
 from scipy.interpolate import interp1d
 
@@ -25,6 +27,24 @@ def simul_shocks(n_sample, T, mparam, state_init=None):
 
     return ashock, ishock
 
+def simul_shocks_tf(T, mparam, state_init, rng):
+    # TensorFlow version of simul_shocks starting from state_init, with random numbers drawn from
+    # the tf.random.Generator rng, so that the shocks are simulated on device
+    # return ashock [n_sample, T], ishock [n_sample, n_agt, T]
+    y_init = tf.cast(state_init["ishock"], "float64")
+    shape = tf.shape(y_init)
+    ashock = mparam.dt**0.5*rng.normal([shape[0], T], 0, mparam.sigma, dtype="float64")
+    rand = rng.uniform(tf.concat([[T-1], shape], axis=0), dtype="float64")
+
+    def step(y_agt, rand_t):
+        ur_rate = (1 - y_agt) * (1 - mparam.la1 * mparam.dt) # unemployed now, (1-lambda1*dt) to remain unemployed
+        ur_rate += y_agt * mparam.la2 * mparam.dt            # employed now, lambda2*dt to become unemployed
+        return tf.cast(rand_t >= ur_rate, "float64")
+
+    ishock = tf.scan(step, rand, initializer=y_init)
+    ishock = tf.transpose(tf.concat([y_init[None], ishock], axis=0), [1, 2, 0])
+    return ashock, tf.cast(ishock, "int8")
+
 def simul_k(n_sample, T, mparam, c_policy, policy_type, state_init=None, shocks=None):
     # policy_type: "pde" or "nn_share"
     # return k_cross [n_sample, n_agt, T]
@@ -57,25 +77,36 @@ def simul_k(n_sample, T, mparam, c_policy, policy_type, state_init=None, shocks=
             N[:, 0] = mparam.N_dss
             B[:, 0] = mparam.k_dss
 
-    for t in range(1, T):
-        K = B[:, t-1] + N[:, t-1]
-        wage_unit = (1 - mparam.alpha) * K[:, None]**mparam.alpha
-        wage = (ishock[:, :, t-1] * (mparam.z2-mparam.z1) + mparam.z1) * wage_unit  # map 0 to z1 and 1 to z2
-        r = mparam.alpha * K[:, None]**(mparam.alpha-1) - mparam.delta - mparam.sigma2*K[:, None]/N[:, t-1:t]
-        wealth = (1 + r*mparam.dt) * k_cross[:, :, t-1] + wage * mparam.dt
-        if policy_type == "pde":
-            # to avoid negative wealth
-            csmp[:, :, t-1] = np.minimum(
-                c_policy(k_cross[:, :, t-1], N[:, t-1:t], ishock[:, :, t-1]),
-                wealth/mparam.dt-EPSILON)
-        elif policy_type == "nn_share":
-            csmp[:, :, t-1] = c_policy(k_cross[:, :, t-1], N[:, t-1:t], ishock[:, :, t-1]) * (wealth / mparam.dt)
-        k_cross[:, :, t] = wealth - csmp[:, :, t-1] * mparam.dt
-        B[:, t] = np.mean(k_cross[:, :, t], axis=1)
-        dN_drift = mparam.dt * (mparam.alpha * K**(mparam.alpha-1) - mparam.delta - mparam.rhohat - \
-            mparam.sigma2*(-B[:, t-1]/N[:, t-1])*(K/N[:, t-1]))*N[:, t-1]
-        dN_diff = K * ashock[:, t-1]
-        N[:, t] = N[:, t-1] + dN_drift + dN_diff
+    if policy_type == "nn_share" and isinstance(c_policy, tf.types.experimental.PolymorphicFunction):
+        # a compiled policy is rolled out on device, the trajectories are copied back to numpy only once
+        k_path, N_path, csmp_path = simul_k_tf(mparam, c_policy)(
+            tf.cast(k_cross[:, :, 0], "float64"), tf.cast(N[:, 0:1], "float64"),
+            tf.cast(ashock, "float64"), tf.cast(ishock, "float64")
+        )
+        k_cross = np.transpose(k_path.numpy(), (1, 2, 0))
+        N = np.transpose(N_path.numpy()[..., 0])
+        csmp = np.transpose(csmp_path.numpy(), (1, 2, 0))
+        B = np.mean(k_cross, axis=1)
+    else:
+        for t in range(1, T):
+            K = B[:, t-1] + N[:, t-1]
+            wage_unit = (1 - mparam.alpha) * K[:, None]**mparam.alpha
+            wage = (ishock[:, :, t-1] * (mparam.z2-mparam.z1) + mparam.z1) * wage_unit  # map 0 to z1 and 1 to z2
+            r = mparam.alpha * K[:, None]**(mparam.alpha-1) - mparam.delta - mparam.sigma2*K[:, None]/N[:, t-1:t]
+            wealth = (1 + r*mparam.dt) * k_cross[:, :, t-1] + wage * mparam.dt
+            if policy_type == "pde":
+                # to avoid negative wealth
+                csmp[:, :, t-1] = np.minimum(
+                    c_policy(k_cross[:, :, t-1], N[:, t-1:t], ishock[:, :, t-1]),
+                    wealth/mparam.dt-EPSILON)
+            elif policy_type == "nn_share":
+                csmp[:, :, t-1] = c_policy(k_cross[:, :, t-1], N[:, t-1:t], ishock[:, :, t-1]) * (wealth / mparam.dt)
+            k_cross[:, :, t] = wealth - csmp[:, :, t-1] * mparam.dt
+            B[:, t] = np.mean(k_cross[:, :, t], axis=1)
+            dN_drift = mparam.dt * (mparam.alpha * K**(mparam.alpha-1) - mparam.delta - mparam.rhohat - \
+                mparam.sigma2*(-B[:, t-1]/N[:, t-1])*(K/N[:, t-1]))*N[:, t-1]
+            dN_diff = K * ashock[:, t-1]
+            N[:, t] = N[:, t-1] + dN_drift + dN_diff
 
     # print(B.max(), B.min(), N.max(), N.min(), csmp.min(), csmp.max())
     # if k_cross.min() < 0 or N.min() < 0:
@@ -84,6 +115,45 @@ def simul_k(n_sample, T, mparam, c_policy, policy_type, state_init=None, shocks=
     return simul_data
 
 
+@functools.lru_cache(maxsize=None)
+def simul_k_tf(mparam, c_policy):
+    # TensorFlow version of the "nn_share" branch of simul_k, with c_policy a compiled TensorFlow function.
+    # It is compiled once for each mparam and c_policy, which it closes over, with a signature that
+    # leaves the number of paths, agents and periods free
+    # return k_cross [T, n_sample, n_agt], N [T, n_sample, 1], csmp [T-1, n_sample, n_agt]
+    @tf.function(jit_compile=True, input_signature=[
+        tf.TensorSpec([None, None], "float64"),
+        tf.TensorSpec([None, 1], "float64"),
+        tf.TensorSpec([None, None], "float64"),
+        tf.TensorSpec([None, None, None], "float64"),
+    ])
+    def rollout(k_init, N_init, ashock, ishock):
+        ashock = tf.transpose(ashock)[..., None]  # T*n_sample*1
+        ishock = tf.transpose(ishock, [2, 0, 1])  # T*n_sample*n_agt
+
+        def step(carry, shocks):
+            k_cross, N, _ = carry
+            a_t, i_t = shocks
+            B = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+            K = B + N
+            wage_unit = (1 - mparam.alpha) * K**mparam.alpha
+            wage = (i_t * (mparam.z2-mparam.z1) + mparam.z1) * wage_unit  # map 0 to z1 and 1 to z2
+            r = mparam.alpha * K**(mparam.alpha-1) - mparam.delta - mparam.sigma2*K/N
+            wealth = (1 + r*mparam.dt) * k_cross + wage * mparam.dt
+            csmp = c_policy(k_cross, N, i_t) * (wealth / mparam.dt)
+            dN_drift = mparam.dt * (mparam.alpha * K**(mparam.alpha-1) - mparam.delta - mparam.rhohat - \
+                mparam.sigma2*(-B/N)*(K/N))*N
+            dN_diff = K * a_t
+            return wealth - csmp * mparam.dt, N + dN_drift + dN_diff, csmp
+
+        k_cross, N, csmp = tf.scan(
+            step, (ashock[:-1], ishock[:-1]), initializer=(k_init, N_init, tf.zeros_like(k_init))
+        )
+        return tf.concat([k_init[None], k_cross], axis=0), tf.concat([N_init[None], N], axis=0), csmp
+
+    return rollout
+
+
 def c_policy_spl_DSS(k_cross, N, ishock, splines):  # pylint: disable=W0613
     c = np.zeros_like(k_cross)
     idx = (ishock == 0)
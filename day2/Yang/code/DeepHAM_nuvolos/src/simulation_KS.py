@@ -1,4 +1,6 @@
+import functools
 import numpy as np
+import tensorflow as tf
 from scipy.interpolate import RectBivariateSpline
 
 EPSILON = 1e-3
@@ -36,6 +38,35 @@ def simul_shocks(n_sample, T, mparam, state_init=None):
     return ashock, ishock
 
 
+def simul_shocks_tf(T, mparam, state_init, rng):
+    # TensorFlow version of simul_shocks starting from state_init, with random numbers drawn from
+    # the tf.random.Generator rng, so that the shocks are simulated on device
+    # return ashock [n_sample, T], ishock [n_sample, n_agt, T]
+    # convert productivity to 0/1 variable
+    a_init = ((tf.cast(state_init["ashock"][:, 0], "float64") - 1) / mparam.delta_a + 1) / 2
+    y_init = tf.cast(state_init["ishock"], "float64")
+    shape = tf.shape(y_init)
+    if_keep = tf.cast(rng.uniform([T-1, shape[0]], dtype="float64") < 0.875, "float64")  # prob for Z to stay the same is 0.875
+    rand = rng.uniform(tf.concat([[T-1], shape], axis=0), dtype="float64")
+
+    def step(carry, elems):
+        a_prev, y_agt = carry
+        keep, rand_t = elems
+        a_next = keep * a_prev + (1 - keep) * (1 - a_prev)
+        a0, a1 = a_prev[:, None], a_next[:, None]
+        ur_rate = (1 - a0) * (1 - a1) * (1 - y_agt) * mparam.p_bb_uu + (1 - a0) * (1 - a1) * y_agt * mparam.p_bb_eu
+        ur_rate += (1 - a0) * a1 * (1 - y_agt) * mparam.p_bg_uu + (1 - a0) * a1 * y_agt * mparam.p_bg_eu
+        ur_rate += a0 * (1 - a1) * (1 - y_agt) * mparam.p_gb_uu + a0 * (1 - a1) * y_agt * mparam.p_gb_eu
+        ur_rate += a0 * a1 * (1 - y_agt) * mparam.p_gg_uu + a0 * a1 * y_agt * mparam.p_gg_eu
+        return a_next, tf.cast(rand_t >= ur_rate, "float64")
+
+    ashock, ishock = tf.scan(step, (if_keep, rand), initializer=(a_init, y_init))
+    ashock = tf.transpose(tf.concat([a_init[None], ashock], axis=0))
+    ishock = tf.transpose(tf.concat([y_init[None], ishock], axis=0), [1, 2, 0])
+    ashock = (ashock * 2 - 1) * mparam.delta_a + 1  # convert 0/1 variable to productivity
+    return ashock, tf.cast(ishock, "int8")
+
+
 def simul_k(n_sample, T, mparam, policy, policy_type, state_init=None, shocks=None, func=None):
     # input:
     #   policy_type: "pde" or "nn_share"
@@ -84,6 +115,19 @@ def simul_k(n_sample, T, mparam, policy, policy_type, state_init=None, shocks=No
             else:
                 k_cross[t] = cur_k
                 csmp[t-1] = cur_csmp
+    elif policy_type == "nn_share" and isinstance(policy, tf.types.experimental.PolymorphicFunction):
+        # a compiled policy is rolled out on device, the trajectories are copied back to numpy only once
+        k_path, csmp_path = simul_k_tf(mparam, policy)(
+            tf.cast(cur_k, "float64"), tf.cast(ashock, "float64"), tf.cast(ishock, "float64")
+        )
+        k_path, csmp_path = k_path.numpy(), csmp_path.numpy()
+        cur_k, cur_csmp = k_path[-1], csmp_path[-1]
+        if func:
+            if func != 'last':
+                for t in range(1, T):
+                    res[t] = func(k_path[t], csmp_path[t-1])
+        else:
+            k_cross, csmp = k_path, csmp_path
     elif policy_type == "nn_share":
         for t in range(1, T):
             wealth = next_wealth(cur_k, ashock[:, t-1:t], ishock[:, :, t-1], mparam)
@@ -114,6 +158,46 @@ def next_wealth(k_cross, ashock, ishock, mparam):
     return wealth
 
 
+def next_wealth_tf(k_cross, ashock, ishock, mparam):
+    # TensorFlow version of next_wealth
+    k_mean = tf.reduce_mean(k_cross, axis=1, keepdims=True)
+    a_good = tf.cast(ashock >= 1, k_cross.dtype)
+    tau = mparam.tau_b + (mparam.tau_g - mparam.tau_b) * a_good
+    emp = mparam.l_bar * (mparam.er_b + (mparam.er_g - mparam.er_b) * a_good)
+    R = 1 - mparam.delta + ashock * mparam.alpha*(k_mean / emp)**(mparam.alpha-1)
+    wage = ashock*(1-mparam.alpha)*(k_mean / emp)**(mparam.alpha)
+    wealth = R * k_cross + (1-tau)*wage*mparam.l_bar*ishock + mparam.mu*wage*(1-ishock)
+    return wealth
+
+
+@functools.lru_cache(maxsize=None)
+def simul_k_tf(mparam, policy):
+    # TensorFlow version of the "nn_share" branch of simul_k, with policy a compiled TensorFlow function.
+    # It is compiled once for each mparam and policy, which it closes over, with a signature that
+    # leaves the number of paths, agents and periods free
+    # return k_cross [T, n_sample, n_agt], csmp [T-1, n_sample, n_agt]
+    @tf.function(jit_compile=True, input_signature=[
+        tf.TensorSpec([None, None], "float64"),
+        tf.TensorSpec([None, None], "float64"),
+        tf.TensorSpec([None, None, None], "float64"),
+    ])
+    def rollout(k_init, ashock, ishock):
+        ashock = tf.transpose(ashock)[..., None]  # T*n_sample*1
+        ishock = tf.transpose(ishock, [2, 0, 1])  # T*n_sample*n_agt
+
+        def step(carry, shocks):
+            k_cross, _ = carry
+            a_t, i_t = shocks
+            wealth = next_wealth_tf(k_cross, a_t, i_t, mparam)
+            csmp = tf.clip_by_value(policy(k_cross, a_t, i_t) * wealth, EPSILON, wealth-EPSILON)
+            return wealth - csmp, csmp
+
+        k_cross, csmp = tf.scan(step, (ashock[:-1], ishock[:-1]), initializer=(k_init, tf.zeros_like(k_init)))
+        return tf.concat([k_init[None], k_cross], axis=0), csmp
+
+    return rollout
+
+
 def k_policy_bspl(k_cross, ashock, ishock, splines):
     k_next = np.zeros_like(k_cross)
     k_mean = np.repeat(np.mean(k_cross, axis=1, keepdims=True), k_cross.shape[1], axis=1)
@@ -7,9 +7,8 @@ import os
 # os.environ['TF_NUM_INTEROP_THREADS'] = '1'
 
 import tensorflow as tf
-# gpus = tf.config.list_physical_devices('GPU')
-# for gpu in gpus:
-#     tf.config.experimental.set_memory_growth(gpu, True)
+from util import configure_gpu_memory
+configure_gpu_memory()
 
 import json
 import time
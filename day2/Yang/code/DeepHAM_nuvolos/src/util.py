@@ -12,6 +12,42 @@ def set_random_seed(seed):
     tf.random.set_seed(seed)
     tf.config.experimental.enable_op_determinism()
 
+def configure_gpu_memory():
+    # by default the GPU memory grows on demand, as train_JFV.py used to set up.
+    # DEEPHAM_GPU_MEM_FRAC in (0, 1] instead reserves that fraction of the GPU memory as one fixed slab
+    # up front. Must be called before any op touches the GPU.
+    gpus = tf.config.list_physical_devices('GPU')
+    frac = os.environ.get("DEEPHAM_GPU_MEM_FRAC")
+    if frac is not None:
+        frac = float(frac)
+        if not 0 < frac <= 1:
+            raise ValueError("DEEPHAM_GPU_MEM_FRAC must be in (0, 1], got %g." % frac)
+    total_mb = gpu_memory_mb() if frac is not None and gpus else None
+    for gpu in gpus:
+        if total_mb is None:
+            tf.config.experimental.set_memory_growth(gpu, True)
+        else:
+            tf.config.set_logical_device_configuration(
+                gpu, [tf.config.LogicalDeviceConfiguration(memory_limit=int(total_mb * frac))]
+            )
+
+def gpu_memory_mb():
+    # TensorFlow only reports the memory of a GPU once it is initialized, which fixes its configuration,
+    # so the total memory of the smallest GPU is read from NVML (the nvidia-ml-py package)
+    try:
+        import pynvml
+    except ImportError:
+        print("Cannot query GPU memory without nvidia-ml-py, letting the GPU memory grow on demand.")
+        return None
+    pynvml.nvmlInit()
+    try:
+        return min(
+            pynvml.nvmlDeviceGetMemoryInfo(pynvml.nvmlDeviceGetHandleByIndex(i)).total
+            for i in range(pynvml.nvmlDeviceGetCount())
+        ) / 2**20
+    finally:
+        pynvml.nvmlShutdown()
+
 # def create_model(d_in, d_out, config):
 #     model = keras.Sequential()
 #     model.add(keras.layers.InputLayer([d_in]))
@@ -23,15 +59,23 @@ def set_random_seed(seed):
 class FeedforwardModel(keras.Model):
     def __init__(self, d_in, d_out, config, name="agentmodel", **kwargs):
         super(FeedforwardModel, self).__init__(name=name, **kwargs)
-        self.dense_layers = [keras.layers.Dense(w, activation=config["activation"]) for w in config["net_width"]]
-        self.dense_layers.append(keras.layers.Dense(d_out, activation=None))
+        # optional keras precision policy for the dense layers, e.g. "mixed_bfloat16": the matmuls run in
+        # reduced precision while the variables and the economic recurrence outside the nets stay in DTYPE
+        dtype = config.get("dtype_policy")
+        self.dense_layers = [
+            keras.layers.Dense(w, activation=config["activation"], dtype=dtype) for w in config["net_width"]
+        ]
+        self.dense_layers.append(keras.layers.Dense(d_out, activation=None, dtype=dtype))
         self.d_in = d_in
 
     def call(self, inputs):
-        x = self.dense_layers[0](inputs)
-        for l in self.dense_layers[1:]:
+        # the dense layers see a 2-D view of the inputs: on rank-3 inputs keras uses tensordot, whose
+        # gradient inside the XLA-compiled while_loop of the policy loss needs a constant transpose
+        x = tf.reshape(inputs, [-1, inputs.shape[-1]])
+        for l in self.dense_layers:
             x = l(x)
-        return x
+        x = tf.reshape(x, tf.concat([tf.shape(inputs)[:-1], tf.shape(x)[-1:]], axis=0))
+        return tf.cast(x, inputs.dtype)
 
     def load_weights_after_init(self, path):
         # evaluate once for creating variables before loading weights
@@ -44,10 +88,7 @@ class GeneralizedMomModel(FeedforwardModel):
         super(GeneralizedMomModel, self).__init__(d_in, d_out, config, name=name, **kwargs)
 
     def basis_fn(self, inputs):
-        x = self.dense_layers[0](inputs)
-        for l in self.dense_layers[1:]:
-            x = l(x)
-        return x
+        return super(GeneralizedMomModel, self).call(inputs)
 
     def call(self, inputs):
         x = self.basis_fn(inputs)
@@ -55,6 +96,34 @@ class GeneralizedMomModel(FeedforwardModel):
         gm = tf.tile(gm, [1, inputs.shape[-2], 1])
         return gm
 
+def broadcast_like(x, like):
+    # broadcasts x to the shape of like by adding zeros: the gradient of tf.broadcast_to needs the
+    # target shape at compile time under XLA, which it is not when the batch dimension is left free
+    return x + tf.zeros_like(like)
+
+def batched_value_fn(vtrainers, input_data):
+    # evaluate the value nets of all vtrainers in one pass by stacking the weights of each dense layer
+    # along a leading axis; returns the average value over the nets, of shape B * n_agt
+    if vtrainers[0].config["n_gm"] > 0:
+        # the generalized moments are learned per net, so are the states
+        x = tf.stack([vtr.prepare_state(input_data) for vtr in vtrainers])
+        eq = "vbnj,vji->vbni"
+    else:
+        x = vtrainers[0].prepare_state(input_data)
+        eq = "bnj,vji->vbni"
+    out_dtype = x.dtype
+    # follow the precision policy of the dense layers, as in FeedforwardModel.call
+    x = tf.cast(x, vtrainers[0].model.dense_layers[0].compute_dtype)
+    for i, layer in enumerate(vtrainers[0].model.dense_layers):
+        # keras 3 variables are not tensors, so they are converted before stacking
+        kernel = tf.stack([tf.convert_to_tensor(vtr.model.dense_layers[i].kernel) for vtr in vtrainers])
+        bias = tf.stack([tf.convert_to_tensor(vtr.model.dense_layers[i].bias) for vtr in vtrainers])
+        kernel, bias = tf.cast(kernel, x.dtype), tf.cast(bias, x.dtype)
+        # keras sets the activation of the output layer to linear, so it can be applied unconditionally
+        x = layer.activation(tf.einsum(eq, x, kernel) + bias[:, None, None, :])
+        eq = "vbnj,vji->vbni"
+    return tf.reduce_mean(tf.cast(x[..., 0], out_dtype), axis=0)
+
 def print_elapsedtime(delta):
     hours, rem = divmod(delta, 3600)
     minutes, seconds = divmod(rem, 60)
@@ -42,25 +42,30 @@ class ValueTrainer():
 
     @tf.function
     def prepare_state(self, input_data):
+        # no casts below: checked when traced, so it costs nothing in the compiled graph
+        assert input_data["basic_s"].dtype == DTYPE and input_data["agt_s"].dtype == DTYPE, \
+            "prepare_state expects DTYPE states."
         if self.use_log_k:
-            log_k = tf.math.log(tf.cast(input_data["basic_s"][..., 0:1], DTYPE) + eps)/log_10
+            log_k = tf.math.log(input_data["basic_s"][..., 0:1] + eps)/log_10
             log_k_mean = tf.math.reduce_mean(log_k, axis=1 ,keepdims=True)
             log_k_mean = tf.tile(log_k_mean, [1, input_data["basic_s"].shape[1], 1])
-            basic_s = tf.concat([log_k, log_k_mean, tf.cast(input_data["basic_s"][..., 2:], DTYPE)], axis=-1)
-            agt_s = tf.math.log(tf.cast(input_data["agt_s"], DTYPE))/log_10
+            basic_s = tf.concat([log_k, log_k_mean, input_data["basic_s"][..., 2:]], axis=-1)
+            agt_s = tf.math.log(input_data["agt_s"])/log_10
         else:
-            basic_s = tf.cast(input_data["basic_s"], DTYPE)
-            agt_s = tf.cast(input_data["agt_s"], DTYPE)
+            basic_s = input_data["basic_s"]
+            agt_s = input_data["agt_s"]
         if self.config.get("full_state", False):
             state = tf.concat(
                 [basic_s[..., 0:1], basic_s[..., 2:],
-                 tf.repeat(tf.transpose(tf.cast(input_data["agt_s"], DTYPE), perm=[0, 2, 1]), self.config["n_agt"], axis=-2)],
+                 tf.repeat(tf.transpose(input_data["agt_s"], perm=[0, 2, 1]), self.config["n_agt"], axis=-2)],
                  axis=-1
             )
             # tf.print(tf.repeat(basic_s[..., 0:1], self.config["n_agt"], axis=-1) - tf.repeat(tf.cast(input_data["agt_s"], DTYPE), self.config["n_agt"], axis=-1))
         elif self.config["n_fm"] == 2:
-            k_var = tf.math.reduce_variance(agt_s, axis=-2, keepdims=True)
-            k_var = tf.tile(k_var, [1, agt_s.shape[1], 1])
+            # one pass over agt_s: Var = E[x^2] - E[x]^2, clipped at 0 against rounding
+            k_mean = tf.reduce_mean(agt_s, axis=-2, keepdims=True)
+            k_var = tf.maximum(tf.reduce_mean(tf.square(agt_s), axis=-2, keepdims=True) - tf.square(k_mean), 0)
+            k_var = util.broadcast_like(k_var, agt_s)
             state = tf.concat([basic_s, k_var], axis=-1)
         elif self.config["n_fm"] == 0:
             state = tf.concat([basic_s[..., 0:1], basic_s[..., 2:]], axis=-1)
@@ -86,7 +91,7 @@ class ValueTrainer():
         return loss_dict
 
     def grad(self, input_data):
-        with tf.GradientTape(persistent=True) as tape:
+        with tf.GradientTape() as tape:
             loss = self.loss(input_data)["loss"]
         # self.train_loss_metric(loss)
         train_vars = self.model.trainable_variables
@@ -98,7 +103,6 @@ class ValueTrainer():
             train_vars,
             unconnected_gradients=tf.UnconnectedGradients.ZERO,
         )
-        del tape
         return grad
 
     @tf.function